@@ -14,12 +14,29 @@ import os
 import pickle
 import base64
 import asyncio
-from util.db_manager import DatabaseManager
+import contextlib
+import redis
+import codecs
+import csv
+import io
+import shutil
+import zipfile
+import zlib
+import math
+import tempfile
+import itertools
+import threading
+import anyio
+from util.db_manager import DatabaseManager, SEARCH_SORTS, EXPORT_QUERIES
 from util.ws_manager import WebSocketManager
-from fastapi import FastAPI, Depends, HTTPException, Request, File, Form, UploadFile, status
-from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse
+from util.bid_writer import BidWriter
+from util.leader_election import LeaderElector
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, File, Form, UploadFile, status
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from mysql.connector.pooling import MySQLConnectionPool
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.executors.pool import ThreadPoolExecutor
@@ -35,12 +52,44 @@ from googleapiclient.discovery import build
 CHUNK_SIZE = 2048
 ALLOWED_IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
 MAX_BID_AMOUNT = 99999999.99
+# A bid in the final ANTI_SNIPE_WINDOW_SECONDS of an auction extends it by ANTI_SNIPE_EXTENSION_SECONDS
+ANTI_SNIPE_WINDOW_SECONDS = 30
+ANTI_SNIPE_EXTENSION_SECONDS = 30
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
+BID_FLUSH_INTERVAL_MS = 200
+BID_FLUSH_MAX_ROWS = 100
+BID_HISTORY_PAGE_SIZE = 50
+BID_HISTORY_MAX_PAGE_SIZE = 200
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_STATUSES = {"all", "active", "ended"}
+WS_MAX_CONNECTIONS = 1000
+WS_MAX_CONNECTIONS_PER_IP = 20
+WS_MAX_CONNECTIONS_PER_USER = 5
+WS_HEARTBEAT_INTERVAL = 20
+WS_IDLE_TIMEOUT = 60
+WS_EVENT_HISTORY_SIZE = 1000
+BULK_IMPORT_CHUNK_SIZE = 500
+BULK_IMPORT_MAX_ERRORS = 100
+BULK_EXPORT_BATCH_SIZE = 500
+BULK_EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# Exports hold a pooled connection for as long as the download takes, so only a few may run at once
+BULK_EXPORT_MAX_CONCURRENT = 2
+MAX_TEXT_LENGTH = 255
+SCHEDULER_LEASE_KEY = "scheduler:leader"
+SCHEDULER_LEASE_TTL_MS = 15000
 
 app = FastAPI()
 load_dotenv()
 db_manager = DatabaseManager()
-ws_manager = WebSocketManager()
+ws_manager = WebSocketManager(
+    max_connections=WS_MAX_CONNECTIONS,
+    max_connections_per_ip=WS_MAX_CONNECTIONS_PER_IP,
+    max_connections_per_user=WS_MAX_CONNECTIONS_PER_USER,
+    heartbeat_interval=WS_HEARTBEAT_INTERVAL,
+    idle_timeout=WS_IDLE_TIMEOUT,
+    history_size=WS_EVENT_HISTORY_SIZE
+)
 executors = {
     'default': ThreadPoolExecutor(20),
 }
@@ -60,6 +109,22 @@ dbconfig = {
     "database": "database",
 }
 pool = MySQLConnectionPool(pool_name="mypool", pool_size=10, **dbconfig)
+export_slots = threading.BoundedSemaphore(BULK_EXPORT_MAX_CONCURRENT)
+
+"""
+Set up the buffered writer that appends accepted bids to the bid history
+"""
+bid_writer = BidWriter(pool, flush_interval_ms=BID_FLUSH_INTERVAL_MS, max_batch_size=BID_FLUSH_MAX_ROWS)
+
+"""
+Set up leader election so scheduled jobs run on exactly one process across all workers and replicas
+"""
+scheduler_redis = redis.Redis(
+    host=os.environ.get('REDIS_HOST', 'redis'),
+    port=int(os.environ.get('REDIS_PORT', 6379)),
+    decode_responses=True
+)
+leader_elector = LeaderElector(scheduler_redis, SCHEDULER_LEASE_KEY, lease_ttl_ms=SCHEDULER_LEASE_TTL_MS)
 
 """
 Create a database connection using a connection pool
@@ -73,6 +138,18 @@ def get_db():
         # Ensure that the connection is closed after usage
         connection.close()
 
+"""
+Context manager version of get_db, for code that only needs a connection briefly
+"""
+db_session = contextlib.contextmanager(get_db)
+
+"""
+Get the client IP address of a request or websocket, honouring X-Forwarded-For
+"""
+def get_client_ip(connection):
+    x_forwarded_for = connection.headers.get('x-forwarded-for')
+    return x_forwarded_for.split(',')[0] if x_forwarded_for else connection.client.host
+
 """
 Hash a given token using SHA-256
 """
@@ -80,8 +157,10 @@ def hash_token(token):
     return hashlib.sha256(token.encode()).hexdigest()
 
 """
-Check for auctions that have ended but do not have winners, and update them
+Check for auctions that have ended but do not have winners, and update them.
+Only the elected leader runs this, see the scheduling at the bottom of this file.
 """
+@leader_elector.run_if_leader
 def check_ended_auctions():
     db_gen = get_db()
     db = next(db_gen)
@@ -105,6 +184,61 @@ def encoder(obj):
         return obj.isoformat()
     raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
 
+"""
+Convert a post row, as returned by get_all_posts or search_posts, to the dictionary sent to clients
+"""
+def post_to_dict(post):
+    end_time = post[8]
+    if end_time:
+        # Convert the UTC end_time from the database to Eastern Time
+        end_time = pytz.utc.localize(end_time).astimezone(pytz.timezone('US/Eastern')).isoformat()
+
+    return {
+        "id": post[0], 
+        "username": post[1], 
+        "title": post[2], 
+        "description": post[3],
+        "image": post[4],
+        "starting_price": post[5],
+        "current_bid": post[6],
+        "current_bidder": post[7],
+        "end_time": end_time,
+        "duration": post[9],
+        "winner": post[10], 
+        "winning_bid": float(post[11]) if post[11] else None,
+        "likes": post[12],
+        "liked": post[13] > 0
+    }
+
+"""
+Encode the position after a search result row as an opaque pagination cursor
+"""
+def encode_search_cursor(sort_value, post_id):
+    if isinstance(sort_value, datetime.datetime):
+        sort_value = sort_value.isoformat()
+    elif isinstance(sort_value, decimal.Decimal):
+        sort_value = str(sort_value)
+    payload = json.dumps([sort_value, post_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+"""
+Decode a pagination cursor back into the (sort value, id) pair for the given sort order.
+Raises ValueError if the cursor is malformed.
+"""
+def decode_search_cursor(cursor, sort):
+    try:
+        sort_value, post_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        column, _ = SEARCH_SORTS[sort]
+        if column == "end_time":
+            sort_value = datetime.datetime.fromisoformat(sort_value)
+        elif column == "current_bid":
+            sort_value = decimal.Decimal(sort_value)
+        else:
+            sort_value = int(sort_value)
+        return sort_value, int(post_id)
+    except (TypeError, ValueError, ArithmeticError) as e:
+        raise ValueError("Invalid cursor.") from e
+
 """
 Authenticate with Gmail and get the service object
 """
@@ -158,6 +292,13 @@ def send_verification_email(user_email, verification_url):
     except Exception as e:
         print(f'An error occurred: {e}')
 
+"""
+Bring an existing database up to date with the tables and indexes added since it was created
+"""
+def ensure_database_schema():
+    with db_session() as db:
+        db_manager.ensure_schema(db)
+
 """
 Event handler for application startup
 """
@@ -166,6 +307,9 @@ async def startup_event():
     redis_host = os.environ.get('REDIS_HOST', 'redis')
     redis_port = os.environ.get('REDIS_PORT', 6379)
     app.state.redis = await aioredis.from_url(f"redis://{redis_host}:{redis_port}", encoding="utf-8", decode_responses=True)
+    await run_in_threadpool(ensure_database_schema)
+    bid_writer.start()
+    ws_manager.start()
 
 
 """
@@ -176,6 +320,15 @@ async def shutdown_event():
     # Shut down the scheduled job to avoid any lingering tasks
     scheduler.shutdown()
 
+    # Give up the scheduler lease so another process can take over right away
+    leader_elector.release()
+
+    # Flush any bids still waiting to be written to the bid history
+    bid_writer.stop()
+
+    # Stop the websocket heartbeat
+    await ws_manager.stop()
+
     # Close the Redis connection pool
     if app.state.redis:
         await app.state.redis.close()
@@ -190,8 +343,7 @@ Middleware for rate limiting requests per IP address.
 @app.middleware("http")
 async def custom_middleware(request: Request, call_next):
     redis = request.app.state.redis
-    x_forwarded_for = request.headers.get('x-forwarded-for')
-    client_ip = x_forwarded_for.split(',')[0] if x_forwarded_for else request.client.host
+    client_ip = get_client_ip(request)
     key = f"rate_limit:{client_ip}"
     
     try:
@@ -429,42 +581,57 @@ Endpoint to retrieve all the posts.
 @app.get("/get-posts/")
 async def get_posts(request: Request, db: mysql.connector.MySQLConnection = Depends(get_db)):
     token = request.cookies.get("token")
-    utc_zone = pytz.utc
-    eastern_zone = pytz.timezone('US/Eastern')
     posts_data = db_manager.get_all_posts(token, db)
 
-    posts = []
-    for post_tuple in posts_data:
-        post = list(post_tuple)
+    # Return a list of post dictionaries with likes count
+    return {"posts": [post_to_dict(post) for post in posts_data]}
 
-        if post[8]:
-            # Convert the UTC end_time from the database to Eastern Time
-            eastern_end_time = utc_zone.localize(post[8]).astimezone(eastern_zone)
-            post[8] = eastern_end_time.isoformat()  # Modify the end_time value
+"""
+Endpoint to search the auctions by title and description, with optional filters on
+status (all, active or ended), price range and seller, sorted by ending_soon, price_low,
+price_high or likes. Pass the returned next_cursor as "cursor" to fetch the following page.
+"""
+@app.get("/search")
+def search(
+    request: Request,
+    q: Optional[str] = None,
+    status: str = "all",
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    seller: Optional[str] = None,
+    sort: str = "ending_soon",
+    cursor: Optional[str] = None,
+    limit: int = SEARCH_PAGE_SIZE,
+    db: mysql.connector.MySQLConnection = Depends(get_db)
+):
+    if status not in SEARCH_STATUSES:
+        return JSONResponse(status_code=400, content={"error": f"status must be one of: {', '.join(sorted(SEARCH_STATUSES))}."})
+    if sort not in SEARCH_SORTS:
+        return JSONResponse(status_code=400, content={"error": f"sort must be one of: {', '.join(SEARCH_SORTS)}."})
+    if limit < 1 or limit > SEARCH_MAX_PAGE_SIZE:
+        return JSONResponse(status_code=400, content={"error": f"limit must be between 1 and {SEARCH_MAX_PAGE_SIZE}."})
+
+    after = None
+    if cursor:
+        try:
+            after = decode_search_cursor(cursor, sort)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
 
-        posts.append(post)
+    token = request.cookies.get("token")
+    text = q.strip() if q else None
+    # Fetch one extra row to find out whether there is a next page
+    rows = db_manager.search_posts(token, text, status, min_price, max_price, seller, sort, after, limit + 1, db)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_search_cursor(last[14], last[0])
 
-    # Return a list of post dictionaries with likes count
     return {
-        "posts": [
-            {
-                "id": post[0], 
-                "username": post[1], 
-                "title": post[2], 
-                "description": post[3],
-                "image": post[4],
-                "starting_price": post[5],
-                "current_bid": post[6],
-                "current_bidder": post[7],
-                "end_time": post[8],
-                "duration": post[9],
-                "winner": post[10], 
-                "winning_bid": float(post[11]) if post[11] else None,
-                "likes": post[12],
-                "liked": post[13] > 0
-            }
-            for post in posts
-        ]
+        "posts": [post_to_dict(post) for post in rows],
+        "next_cursor": next_cursor
     }
 
 """
@@ -480,71 +647,441 @@ async def toggle_like(post_id: int, request: Request, db: mysql.connector.MySQLC
     return db_manager.toggle_post_like(post_id, hashed_token, db)
 
 """
-Handles websocket operations.
+Endpoint to retrieve the bid history of an auction, newest bids first.
+Pass the returned next_cursor as "before" to fetch the following page.
 """
-@app.websocket("/websocket")
-async def websocket_endpoint(websocket: fastapi.WebSocket, db: mysql.connector.MySQLConnection = Depends(get_db)):
-    await ws_manager.connect(websocket)
+@app.get("/auctions/{auction_id}/bids")
+def get_auction_bids(
+    auction_id: int,
+    before: Optional[int] = None,
+    limit: int = BID_HISTORY_PAGE_SIZE,
+    db: mysql.connector.MySQLConnection = Depends(get_db)
+):
+    if limit < 1 or limit > BID_HISTORY_MAX_PAGE_SIZE:
+        return JSONResponse(status_code=400, content={"error": f"limit must be between 1 and {BID_HISTORY_MAX_PAGE_SIZE}."})
+
+    bids = db_manager.get_bids_for_post(auction_id, before, limit, db)
+    return {
+        "bids": [
+            {
+                "id": bid["id"],
+                "username": bid["username"],
+                "amount": float(bid["amount"]),
+                "placed_at": pytz.utc.localize(bid["placed_at"]).isoformat()
+            }
+            for bid in bids
+        ],
+        "next_cursor": bids[-1]["id"] if len(bids) == limit else None
+    }
+
+"""
+Look up the username for a websocket token, using a connection only for the lookup
+"""
+def get_websocket_username(token):
+    with db_session() as db:
+        return db_manager.get_username_from_token(token, db)
+
+"""
+Place a bid on behalf of a websocket client, using a connection only for this message
+"""
+def place_websocket_bid(auction_id, bid_value, token):
+    with db_session() as db:
+        return db_manager.update_bid_if_higher(
+            auction_id, bid_value, token, db,
+            extension_window=ANTI_SNIPE_WINDOW_SECONDS,
+            extension_seconds=ANTI_SNIPE_EXTENSION_SECONDS
+        )
+
+"""
+Fetch all the posts for a websocket client, with end times converted to Eastern Time
+"""
+def get_websocket_posts(token):
     utc_zone = pytz.utc
     eastern_zone = pytz.timezone('US/Eastern')
+    with db_session() as db:
+        latest_posts = db_manager.get_all_posts(token, db)
+
+    posts = []
+    # Convert end_time of each post from UTC to Eastern Time
+    for post_tuple in latest_posts:
+        post = list(post_tuple)
+        if post[8]:
+            # Convert to Eastern Time
+            eastern_end_time = utc_zone.localize(post[8]).astimezone(eastern_zone)
+            # Update the end_time to the ISO format string in Eastern Time
+            post[8] = eastern_end_time.isoformat()
+            # Update the original post with the new end_time
+        posts.append(post)
+    return posts
+
+"""
+Get the database clock and the deadlines of the active auctions in epoch milliseconds,
+the deadlines keyed by auction id
+"""
+def get_websocket_deadlines():
+    with db_session() as db:
+        now, auctions = db_manager.get_active_auction_deadlines(db)
+    return to_epoch_ms(now), {auction_id: to_epoch_ms(end_time) for auction_id, end_time in auctions}
+
+"""
+Convert a naive UTC datetime from the database to epoch milliseconds
+"""
+def to_epoch_ms(value):
+    return int(pytz.utc.localize(value).timestamp() * 1000)
+
+"""
+Validate one row of a bulk import and return its title, description, image, starting price,
+duration and end time. Raises ValueError if the row is invalid.
+"""
+def parse_bulk_listing(row):
+    if not isinstance(row, dict):
+        raise ValueError("Listing must be an object.")
+    title = row.get("title")
+    description = row.get("description")
+    image = row.get("image")
+    if not title or not description or not image or not row.get("starting_price") or not row.get("duration"):
+        raise ValueError("All fields are required.")
+    if len(str(title)) > MAX_TEXT_LENGTH or len(str(description)) > MAX_TEXT_LENGTH:
+        raise ValueError("Input data too long.")
+
+    if os.path.splitext(image)[1].lower() not in ALLOWED_IMAGE_EXTENSIONS:
+        raise ValueError("Invalid image file format.")
+    starting_price = float(row["starting_price"])
+    if not math.isfinite(starting_price) or starting_price <= 0 or starting_price > MAX_BID_AMOUNT:
+        raise ValueError("The starting price must be positive and not exceed the maximum allowed value.")
+    duration = int(row["duration"])
+    if duration <= 0:
+        raise ValueError("Duration must be positive.")
+    try:
+        end_time_utc = datetime.datetime.now(pytz.utc) + datetime.timedelta(minutes=duration)
+    except OverflowError:
+        raise ValueError("Duration results in an invalid end time.")
+
+    return str(title), str(description), image, starting_price, duration, end_time_utc
+
+"""
+Iterate over the rows of an uploaded NDJSON or CSV listings file as (line number, row) pairs,
+decoding the upload as it is read instead of loading it into memory
+"""
+def iter_bulk_listings(upload):
+    lines = codecs.iterdecode(upload.file, "utf-8-sig")
+    if upload.filename.lower().endswith(".csv"):
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(lines, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError:
+                    yield line_number, None
+
+"""
+Endpoint to create many listings at once for the logged in user.
+Takes a streamed NDJSON or CSV file of listings with the same fields as make-post, where
+"image" names a file in the accompanying zip archive of images. Listings are inserted in
+chunks of BULK_IMPORT_CHUNK_SIZE, each with one multi-row INSERT and one commit; invalid
+rows are skipped and reported. A database connection is only held while a chunk is being
+written, not while the upload is read, and connected clients get the new feed afterwards.
+"""
+@app.post("/bulk/import")
+def bulk_import(
+    request: Request,
+    listings: UploadFile = File(...),
+    images: UploadFile = File(...)
+):
+    token = request.cookies.get("token")
+    if token is None:
+        return JSONResponse(status_code=403, content={"error": "Login required to make a post."})
+    with db_session() as db:
+        result = db_manager.get_user_from_token(hash_token(token), db)
+    if not result:
+        return JSONResponse(status_code=403, content={"error": "Please register and login with your account to make a post."})
+    username = result[0]
+
+    if not listings.filename.lower().endswith((".ndjson", ".jsonl", ".csv")):
+        return JSONResponse(status_code=400, content={"error": "Listings must be an NDJSON or CSV file."})
+
+    if not os.path.exists("public/images"):
+        os.makedirs("public/images")
+
+    imported = 0
+    errors = []
+    # Pending rows of the current chunk as (line number, post values, image path)
+    chunk = []
+
+    def flush_chunk():
+        nonlocal imported
+        if not chunk:
+            return
+        with db_session() as db:
+            try:
+                db_manager.insert_posts_bulk([post for _, post, _ in chunk], db)
+                imported += len(chunk)
+            except mysql.connector.Error:
+                # Find the rows that broke the batch by inserting them one at a time
+                for line_number, post, image_path in chunk:
+                    try:
+                        db_manager.insert_posts_bulk([post], db)
+                        imported += 1
+                    except mysql.connector.Error as err:
+                        # Don't leave images behind for listings that were never created
+                        os.remove(image_path)
+                        errors.append({"line": line_number, "error": bulk_insert_error(err)})
+        chunk.clear()
+
+    def response(status_code=200):
+        if imported:
+            broadcast_new_posts(token)
+        return JSONResponse(status_code=status_code, content={
+            "imported": imported,
+            "failed": len(errors),
+            "errors": errors[:BULK_IMPORT_MAX_ERRORS]
+        })
+
+    # Starlette's SpooledTemporaryFile is not fully file-like before Python 3.11, which
+    # zipfile needs when opening members, so copy the archive to a real temporary file
+    with tempfile.TemporaryFile() as archive_file:
+        shutil.copyfileobj(images.file, archive_file, CHUNK_SIZE)
+        try:
+            archive = zipfile.ZipFile(archive_file)
+        except zipfile.BadZipFile:
+            return JSONResponse(status_code=400, content={"error": "Images must be a zip archive."})
+
+        with archive:
+            try:
+                for line_number, row in iter_bulk_listings(listings):
+                    try:
+                        if row is None:
+                            raise ValueError("Malformed JSON.")
+                        title, description, image, starting_price, duration, end_time_utc = parse_bulk_listing(row)
+                    except (TypeError, ValueError) as e:
+                        errors.append({"line": line_number, "error": str(e)})
+                        continue
+                    try:
+                        member = archive.getinfo(image)
+                    except KeyError:
+                        errors.append({"line": line_number, "error": "Image not found in archive."})
+                        continue
+
+                    # Stream the image out of the archive under a unique filename
+                    file_extension = os.path.splitext(image)[1].lower()
+                    unique_filename = f"item_{str(uuid.uuid4())[:10]}_image{file_extension}"
+                    image_path = os.path.join("public/images", unique_filename)
+                    try:
+                        with archive.open(member) as source, open(image_path, "wb") as buffer:
+                            shutil.copyfileobj(source, buffer, CHUNK_SIZE)
+                    except (zipfile.BadZipFile, zlib.error, RuntimeError, NotImplementedError, EOFError):
+                        # Corrupt, encrypted or unsupported member
+                        if os.path.exists(image_path):
+                            os.remove(image_path)
+                        errors.append({"line": line_number, "error": "Image could not be read from archive."})
+                        continue
+
+                    post = (username, title, description, unique_filename, starting_price, starting_price, end_time_utc, duration)
+                    chunk.append((line_number, post, image_path))
+                    if len(chunk) >= BULK_IMPORT_CHUNK_SIZE:
+                        flush_chunk()
+            except (UnicodeDecodeError, csv.Error) as e:
+                # The rest of the file can't be read; keep what was imported so far and report where it stopped
+                errors.append({"line": None, "error": f"Could not read listings file: {e}"})
+                flush_chunk()
+                return response(400)
+
+            flush_chunk()
+
+    return response()
+
+"""
+Send the current feed to every websocket client as a newPost event, the same as a
+newPostRequest does. For endpoints running in the threadpool, so the broadcast itself is
+handed to the event loop.
+"""
+def broadcast_new_posts(token):
+    posts = get_websocket_posts(token)
+    anyio.from_thread.run(ws_manager.broadcast_event, {"type": "newPost", "post": posts}, encoder)
+
+"""
+Map a database error from a bulk import row to a message for the client
+"""
+def bulk_insert_error(err):
+    if err.errno == mysql.connector.errorcode.ER_DATA_TOO_LONG:
+        return "Input data too long."
+    elif err.errno == mysql.connector.errorcode.ER_TRUNCATED_WRONG_VALUE:
+        return "Invalid data format."
+    return "Listing could not be saved."
+
+"""
+Stream the rows of an export as NDJSON or CSV text, one batch of rows per chunk.
+Raises a 503 HTTPException on first iteration if too many exports are already running.
+Each export opens its own connection outside the pool, so one that is abandoned part way
+through can simply be disconnected. The pure Python driver is used for it because the C
+extension reads the rest of an unbuffered result set when the connection is closed.
+"""
+def stream_export(kind, export_format):
+    if not export_slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Too many exports in progress, try again later.")
+
+    try:
+        db = mysql.connector.connect(use_pure=True, **dbconfig)
+        try:
+            header_written = False
+            for rows in db_manager.iter_export_rows(kind, db, batch_size=BULK_EXPORT_BATCH_SIZE):
+                if export_format == "ndjson":
+                    yield "".join(json.dumps(row, default=encoder) + "\n" for row in rows)
+                else:
+                    output = io.StringIO()
+                    writer = csv.DictWriter(output, fieldnames=list(rows[0].keys()))
+                    if not header_written:
+                        writer.writeheader()
+                        header_written = True
+                    writer.writerows(rows)
+                    yield output.getvalue()
+        finally:
+            db.disconnect()
+    finally:
+        export_slots.release()
+
+"""
+Endpoint to export all posts, bids or winners as NDJSON or CSV.
+Rows are written to the response as they are fetched from the database.
+"""
+@app.get("/bulk/export/{kind}")
+def bulk_export(kind: str, request: Request, export_format: str = Query("ndjson", alias="format")):
+    if kind not in EXPORT_QUERIES:
+        return JSONResponse(status_code=404, content={"error": f"Unknown export, expected one of: {', '.join(EXPORT_QUERIES)}."})
+    if export_format not in BULK_EXPORT_FORMATS:
+        return JSONResponse(status_code=400, content={"error": f"format must be one of: {', '.join(BULK_EXPORT_FORMATS)}."})
+
+    # Check the login with a short-lived connection; the stream takes its own for as long as it runs
+    with db_session() as db:
+        username = db_manager.get_username_from_token(request.cookies.get("token"), db)
+    if username == 'Guest':
+        return JSONResponse(status_code=403, content={"error": "Login required to export data."})
+
+    # Start the stream here, so a busy export limit is reported as a 503 before any headers
+    # are sent. The background task closes the stream in the threadpool once the response
+    # is over, whether it completed or the client went away, which releases the export slot
+    # and connection without waiting for the generator to be garbage collected.
+    stream = stream_export(kind, export_format)
+    first_chunk = next(stream, None)
+    body = itertools.chain([first_chunk], stream) if first_chunk is not None else iter(())
+
+    return StreamingResponse(
+        body,
+        media_type=BULK_EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{export_format}"'},
+        background=BackgroundTask(stream.close)
+    )
+
+"""
+Handles websocket operations.
+A database connection is only taken while a message is being handled, so the number of
+open sockets is not limited by the size of the connection pool. Reconnecting clients pass
+epoch and last_seq as query parameters to resume their event stream.
+"""
+@app.websocket("/websocket")
+async def websocket_endpoint(websocket: fastapi.WebSocket):
+    token = websocket.cookies.get("token")
+    username = await run_in_threadpool(get_websocket_username, token)
+
+    # A reconnecting client passes the last event it saw, so the events it missed are
+    # replayed before it starts receiving live broadcasts
+    epoch = websocket.query_params.get("epoch")
+    try:
+        last_seq = int(websocket.query_params["last_seq"])
+    except (KeyError, ValueError):
+        last_seq = None
+
+    client_ip = get_client_ip(websocket)
+    if not await ws_manager.connect(websocket, client_ip, None if username == 'Guest' else username, epoch, last_seq):
+        return
 
     try:
         while True:
             data = await websocket.receive_text()
+            ws_manager.touch(websocket)
             try:
                 message = json.loads(data)
             except json.JSONDecodeError:
                 await ws_manager.send_personal_message("Malformed JSON", websocket)
                 continue
             token = websocket.cookies.get("token")
-            if message["type"] == "bid":
+            if message.get("type") == "pong":
+                continue
+            elif message.get("type") == "timeSync":
+                # Reply with the server clock and the active deadlines, echoing the client
+                # timestamp so the client can correct for the round trip
+                # Report the database clock, since that is what decides whether a bid is late
+                server_time, deadlines = await run_in_threadpool(get_websocket_deadlines)
+                await ws_manager.send(websocket, json.dumps({
+                    "type": "timeSync",
+                    "client_time": message.get("client_time"),
+                    "server_time": server_time,
+                    "deadlines": deadlines
+                }))
+            elif message.get("type") == "bid":
                 if token is None:
-                    await websocket.send_text(json.dumps({"error": "Login required to bid."}))
-                    return
+                    await ws_manager.send(websocket, json.dumps({"error": "Login required to bid."}))
+                    continue
 
                 bid_value = float(message["value"])
                 auction_id = message["auction_id"]
-                result = db_manager.update_bid_if_higher(auction_id, bid_value, token, db)
+                result = await run_in_threadpool(place_websocket_bid, auction_id, bid_value, token)
                 if isinstance(result, str):
-                    await websocket.send_text(json.dumps({"error": result}))
+                    await ws_manager.send(websocket, json.dumps({"error": result}))
                     continue
+
+                bid_writer.record(result["auction_id"], result["bidder"], result["bid_value"], result["placed_at"])
           
-                data = json.dumps({
+                await ws_manager.broadcast_event({
                     "type": "bidUpdate",
                     "value": result["bid_value"],
                     "auction_id": result["auction_id"]
                 })
-                await ws_manager.broadcast(data)
-            elif message["type"] == "newPostRequest":
-                latest_posts = db_manager.get_all_posts(token, db)
-
-                posts = []
-                # Convert end_time of each post from UTC to Eastern Time
-                for post_tuple in latest_posts:
-                    post = list(post_tuple)
-                    if post[8]:
-                        # Convert to Eastern Time
-                        eastern_end_time = utc_zone.localize(post[8]).astimezone(eastern_zone)
-                        # Update the end_time to the ISO format string in Eastern Time
-                        post[8] = eastern_end_time.isoformat()
-                        # Update the original post with the new end_time
-                    posts.append(post)
-
-                data = json.dumps({
+                if result["extended"]:
+                    await ws_manager.broadcast_event({
+                        "type": "deadlineUpdate",
+                        "auction_id": result["auction_id"],
+                        "deadline": to_epoch_ms(result["end_time"])
+                    })
+            elif message.get("type") == "newPostRequest":
+                posts = await run_in_threadpool(get_websocket_posts, token)
+
+                await ws_manager.broadcast_event({
                     "type": "newPost",
                     "post": posts
                 }, default=encoder)
-                await ws_manager.broadcast(data)
             else:
                 await ws_manager.send_personal_message("Invalid data format", websocket)
 
     except Exception as e:
         print(f"Error occurred: {e}")
     finally:
-        ws_manager.disconnect(websocket)
+        await ws_manager.disconnect(websocket)
+
+"""
+Endpoint to report live websocket connection statistics for this process.
+"""
+@app.get("/websocket/stats")
+def websocket_stats():
+    return ws_manager.stats()
 
+"""
+Schedule the leader election heartbeat to acquire or renew the lease well within its TTL,
+starting immediately so a leader is elected as soon as the process comes up
+"""
+scheduler.add_job(
+    leader_elector.heartbeat,
+    trigger='interval',
+    seconds=SCHEDULER_LEASE_TTL_MS / 3000,
+    next_run_time=datetime.datetime.now(),
+    max_instances=1,
+    coalesce=True
+)
 
 """
 Schedule the check_ended_auctions function to run at regular intervals (every 5 seconds)
 """
-scheduler.add_job(check_ended_auctions, trigger='interval', seconds=5)
\ No newline at end of file
+scheduler.add_job(check_ended_auctions, trigger='interval', seconds=5, max_instances=1, coalesce=True)
\ No newline at end of file
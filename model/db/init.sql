@@ -22,7 +22,14 @@ CREATE TABLE IF NOT EXISTS posts (
     duration INT,
     end_time TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    likes_count INT NOT NULL DEFAULT 0,
+    INDEX idx_posts_winner_end_time (winner, end_time),
+    INDEX idx_posts_end_time (end_time),
+    INDEX idx_posts_username (username),
+    INDEX idx_posts_current_bid (current_bid),
+    INDEX idx_posts_likes_count (likes_count),
+    FULLTEXT INDEX ft_posts_title_description (title, description)
 );
 
 CREATE TABLE IF NOT EXISTS post_likes (
@@ -31,4 +38,14 @@ CREATE TABLE IF NOT EXISTS post_likes (
     user_id INT,
     FOREIGN KEY (post_id) REFERENCES posts(id),
     FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+CREATE TABLE IF NOT EXISTS bids (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    post_id INT NOT NULL,
+    username VARCHAR(255) NOT NULL,
+    amount DECIMAL(10, 2) NOT NULL,
+    placed_at TIMESTAMP(6) NOT NULL,
+    INDEX idx_bids_post_id_id (post_id, id),
+    FOREIGN KEY (post_id) REFERENCES posts(id)
 );
\ No newline at end of file
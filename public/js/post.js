@@ -1,4 +1,14 @@
 let ws = null;
+// Position in the server's event stream, used to resume after a reconnect
+let eventEpoch = null;
+let lastEventSeq = null;
+// Milliseconds to add to the local clock to get the server clock
+let clockOffset = 0;
+// Auction deadlines in server epoch milliseconds, keyed by auction id
+const deadlines = new Map();
+// Countdown elements on the page, all updated by a single shared ticker
+let countdowns = [];
+const TIME_SYNC_INTERVAL = 60000;
 
 /**
  * Fetch the posts from the server in JSON format.
@@ -33,6 +43,8 @@ async function fetchData() {
 window.addEventListener('load', function() {
     fetchData();
     setupWebSocket();
+    setInterval(tickCountdowns, 1000);
+    setInterval(requestTimeSync, TIME_SYNC_INTERVAL);
 });
 
 /**
@@ -45,11 +57,13 @@ function displayPosts(posts) {
     const auctionsCreated = document.getElementById("auctions-created");
     allPosts.innerHTML = '';
     auctionsWon.innerHTML = '';
+    countdowns = [];
     const currentUsername = document.getElementById("usernameText").textContent;
     posts.forEach(post => {
         const postElement = document.createElement("div");
-        const currentTime = new Date();
-        const endTime = new Date(post.end_time);
+        const currentTime = serverNow();
+        const endTime = Date.parse(post.end_time);
+        deadlines.set(post.id, endTime);
         let bidLabel = 'Highest bid:';
         let bidValue = post.current_bid || post.starting_price;
         let winnerSectionHTML = '';
@@ -90,14 +104,14 @@ function displayPosts(posts) {
         // Add to All Auctions
         const postCloneForAll = postElement.cloneNode(true);
         const timeDisplayAll = postCloneForAll.querySelector('.time-remaining');
-        startCountdown(endTime, timeDisplayAll);
+        registerCountdown(post.id, timeDisplayAll);
         allPosts.appendChild(postCloneForAll);
 
         // For Auctions Won by the user
         if (currentTime > endTime && post.winner === currentUsername) {
             const postCloneForWon = postElement.cloneNode(true);
             const timeDisplayWon = postCloneForWon.querySelector('.time-remaining');
-            startCountdown(endTime, timeDisplayWon);
+            registerCountdown(post.id, timeDisplayWon);
             auctionsWon.appendChild(postCloneForWon);
         } 
 
@@ -105,12 +119,9 @@ function displayPosts(posts) {
         if (currentUsername === post.username) {
             const postCloneForCreated = postElement.cloneNode(true);
             const timeDisplayCreated = postCloneForCreated.querySelector('.time-remaining');
-            startCountdown(endTime, timeDisplayCreated);
+            registerCountdown(post.id, timeDisplayCreated);
             auctionsCreated.appendChild(postCloneForCreated);
         }
-        
-        const timeDisplay = postElement.querySelector('.time-remaining');
-        startCountdown(endTime, timeDisplay);
     });
 }
 
@@ -166,17 +177,61 @@ function setupWebSocket() {
     // Determine the WebSocket protocol based on the current window protocol
     const wsProtocol = window.location.protocol === "https:" ? "wss" : "ws";
 
+    // On a reconnect, pass the last event seen so the server replays only the missed ones
+    // before any live events
+    let query = '';
+    if (eventEpoch !== null) {
+        query = `?epoch=${encodeURIComponent(eventEpoch)}&last_seq=${lastEventSeq}`;
+    }
+
     // Initialize WebSocket with the appropriate URL
-    ws = new WebSocket(wsProtocol + '://' + window.location.host + '/websocket');
+    ws = new WebSocket(wsProtocol + '://' + window.location.host + '/websocket' + query);
 
     ws.onopen = () => {
         console.log('WebSocket connection opened');
+        requestTimeSync();
     };
 
     // Handle incoming WebSocket messages
     ws.onmessage = (event) => {
         const data = JSON.parse(event.data);
-        if (data.type === 'bidUpdate') {
+        if (data.seq !== undefined && data.type !== 'hello' && data.type !== 'resync') {
+            // Skip events already applied
+            if (data.epoch === eventEpoch && data.seq <= lastEventSeq) {
+                return;
+            }
+            // Events arrive in order, so a gap means some were lost; reload the whole feed.
+            // A newPost carries the whole feed itself, so it covers any events before it
+            // (a resumed replay starts from the last one rather than the first missed event).
+            if (data.epoch !== eventEpoch || (data.seq > lastEventSeq + 1 && data.type !== 'newPost')) {
+                fetchData();
+            }
+            eventEpoch = data.epoch;
+            lastEventSeq = data.seq;
+        }
+
+        if (data.type === 'hello') {
+            // A fresh page starts from the current position; a reconnect gets its missed
+            // events (or a resync) right after the hello
+            if (eventEpoch === null) {
+                eventEpoch = data.epoch;
+                lastEventSeq = data.seq;
+            }
+        } else if (data.type === 'resync') {
+            // The missed events are no longer available, so reload the whole feed
+            eventEpoch = data.epoch;
+            lastEventSeq = data.seq;
+            fetchData();
+        } else if (data.type === 'deadlineUpdate') {
+            // A late bid extended the auction
+            deadlines.set(data.auction_id, data.deadline);
+            tickCountdowns();
+        } else if (data.type === 'timeSync') {
+            applyTimeSync(data);
+        } else if (data.type === 'ping') {
+            // Answer the server heartbeat so this connection is not evicted as idle
+            ws.send(JSON.stringify({ type: 'pong' }));
+        } else if (data.type === 'bidUpdate') {
             updateBid(data.auction_id, data.value);
         } else if (data.type === 'newPost') {
             const posts = data.post.map(convertArrayToPostObject);
@@ -196,7 +251,7 @@ function setupWebSocket() {
         } else {
             console.log(`WebSocket closed unexpectedly with code ${event.code}. Reason: ${event.reason}`);
             console.log("WebSocket closed unexpectedly. Trying to reconnect...");
-            setTimeout(setupWebSocket(), 5000);  // Try to reconnect every 5 seconds
+            setTimeout(setupWebSocket, 5000);  // Try to reconnect every 5 seconds
         }
     };
 }
@@ -212,6 +267,12 @@ async function placeBid(postId) {
         return;
     }
 
+    // Don't send bids the server is going to reject as too late
+    if (deadlines.has(postId) && serverNow() >= deadlines.get(postId)) {
+        alert('Auction has ended');
+        return;
+    }
+
     if (ws.readyState === WebSocket.OPEN) {
         ws.send(JSON.stringify({
             type: 'bid',
@@ -232,36 +293,88 @@ function updateBid(auction_id, value) {
 }
 
 /**
- * Start a countdown timer for the auction, updating the displayed time remaining
+ * Current time according to the server clock, in epoch milliseconds
  */
-function startCountdown(endTime, displayElement) {
-    function updateTimer() {
-        const currentTime = new Date();
-        let difference = endTime - currentTime;
-
-        if (difference <= 0) {
-            clearInterval(interval);
-            displayElement.innerHTML = "<strong>Time Remaining:</strong> Expired";
-            return;
-        }
+function serverNow() {
+    return Date.now() + clockOffset;
+}
+
+/**
+ * Ask the server for its current time and the deadlines of the active auctions
+ */
+function requestTimeSync() {
+    if (ws && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({
+            type: 'timeSync',
+            client_time: Date.now()
+        }));
+    }
+}
+
+/**
+ * Update the clock offset and deadlines from a timeSync reply, assuming the
+ * server read its clock halfway through the round trip
+ */
+function applyTimeSync(data) {
+    const receivedAt = Date.now();
+    const roundTrip = receivedAt - data.client_time;
+    clockOffset = data.server_time + roundTrip / 2 - receivedAt;
 
-        // Calculate days, hours, minutes, and seconds remaining
-        const days = Math.floor(difference / (1000 * 60 * 60 * 24));
-        difference -= days * (1000 * 60 * 60 * 24);
+    for (const [auction_id, deadline] of Object.entries(data.deadlines)) {
+        deadlines.set(Number(auction_id), deadline);
+    }
+    tickCountdowns();
+}
 
-        const hours = Math.floor(difference / (1000 * 60 * 60));
-        difference -= hours * (1000 * 60 * 60);
+/**
+ * Register an element to show the time remaining for an auction
+ */
+function registerCountdown(auction_id, displayElement) {
+    const countdown = { auction_id, displayElement, html: null };
+    countdowns.push(countdown);
+    renderCountdown(countdown, serverNow());
+}
 
-        const minutes = Math.floor(difference / (1000 * 60));
-        difference -= minutes * (1000 * 60);
+/**
+ * Update every countdown on the page from the shared server-synced clock
+ */
+function tickCountdowns() {
+    const currentTime = serverNow();
+    countdowns.forEach(countdown => renderCountdown(countdown, currentTime));
+}
 
-        const seconds = Math.floor(difference / 1000);
+/**
+ * Render the time remaining for a countdown, touching the DOM only when the text changes
+ */
+function renderCountdown(countdown, currentTime) {
+    const html = formatTimeRemaining(deadlines.get(countdown.auction_id) - currentTime);
+    if (html !== countdown.html) {
+        countdown.html = html;
+        countdown.displayElement.innerHTML = html;
+    }
+}
 
-        displayElement.innerHTML = `<strong>Time Remaining:</strong> ${days}d ${hours}h ${minutes}m ${seconds}s`;
+/**
+ * Format a number of milliseconds remaining for display
+ */
+function formatTimeRemaining(difference) {
+    if (!(difference > 0)) {
+        return "<strong>Time Remaining:</strong> Expired";
     }
 
-    const interval = setInterval(updateTimer, 1000);
-    updateTimer();
+    // Calculate days, hours, minutes, and seconds remaining
+    const days = Math.floor(difference / (1000 * 60 * 60 * 24));
+    difference -= days * (1000 * 60 * 60 * 24);
+
+    const hours = Math.floor(difference / (1000 * 60 * 60));
+    difference -= hours * (1000 * 60 * 60);
+
+    const minutes = Math.floor(difference / (1000 * 60));
+    difference -= minutes * (1000 * 60);
+
+    const seconds = Math.floor(difference / 1000);
+
+    return `<strong>Time Remaining:</strong> ${days}d ${hours}h ${minutes}m ${seconds}s`;
 }
 
 /**
@@ -0,0 +1,104 @@
+import threading
+import time
+import mysql.connector
+
+class BidWriter:
+    """
+    Buffers accepted bids in memory and appends them to the bids table in batches.
+    A batch is written as one multi-row INSERT either every flush_interval_ms
+    milliseconds or as soon as max_batch_size bids are waiting, whichever comes first,
+    so recording a bid never adds a database round trip to the bid path itself.
+    """
+    def __init__(self, pool, flush_interval_ms=200, max_batch_size=100, max_pending=10000, max_retry_delay_ms=5000):
+        self.pool = pool
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_retry_delay = max_retry_delay_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.max_pending = max_pending
+        self.buffer = []
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name="bid-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # Wake the writer thread so it drains whatever is still buffered, then wait for it
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def record(self, post_id, username, amount, placed_at):
+        with self.condition:
+            self.buffer.append((post_id, username, amount, placed_at))
+            if len(self.buffer) >= self.max_batch_size:
+                self.condition.notify()
+
+    def _run(self):
+        retry_delay = 0
+        while True:
+            with self.condition:
+                if retry_delay:
+                    # Back off after a failed flush instead of retrying straight away, waking
+                    # early only to shut down
+                    deadline = time.monotonic() + retry_delay
+                    while self.running and time.monotonic() < deadline:
+                        self.condition.wait(deadline - time.monotonic())
+                elif self.running and len(self.buffer) < self.max_batch_size:
+                    self.condition.wait(self.flush_interval)
+                batch = self.buffer[:self.max_batch_size]
+                del self.buffer[:self.max_batch_size]
+                finished = not self.running and not self.buffer
+
+            if batch and self._flush(batch):
+                retry_delay = 0
+            elif batch:
+                # Double the delay on every consecutive failure, up to max_retry_delay
+                retry_delay = min(max(retry_delay * 2, self.flush_interval), self.max_retry_delay)
+                with self.condition:
+                    # Put the failed batch back in front so ordering is kept; drop it only
+                    # if the backlog has grown past max_pending, or on shutdown
+                    if self.running and len(self.buffer) + len(batch) <= self.max_pending:
+                        self.buffer[:0] = batch
+                    elif self.running:
+                        print(f"Dropping {len(batch)} bids that could not be recorded")
+                    else:
+                        print(f"Dropping {len(batch) + len(self.buffer)} bids that could not be recorded")
+                        self.buffer = []
+                        finished = True
+
+            if finished:
+                return
+
+    def _flush(self, batch):
+        try:
+            db = self.pool.get_connection()
+        except mysql.connector.Error as err:
+            print(f"Error occurred: {err}")
+            return False
+
+        cursor = db.cursor()
+        try:
+            # mysql-connector rewrites an INSERT ... VALUES executemany into a single multi-row INSERT
+            cursor.executemany(
+                "INSERT INTO bids(post_id, username, amount, placed_at) VALUES (%s, %s, %s, %s)",
+                batch
+            )
+            db.commit()
+            return True
+        except mysql.connector.Error as err:
+            print(f"Error occurred: {err}")
+            db.rollback()
+            return False
+        finally:
+            cursor.close()
+            db.close()
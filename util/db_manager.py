@@ -6,10 +6,117 @@ from fastapi import HTTPException
 from fastapi.responses import JSONResponse
 
 MAX_BID_AMOUNT = 99999999.99
+# Tables, columns and indexes added after the first release. init.sql only runs when the
+# database volume is created, so existing databases get these from ensure_schema at startup.
+# The append-only bid history
+BID_HISTORY_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS bids (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        post_id INT NOT NULL,
+        username VARCHAR(255) NOT NULL,
+        amount DECIMAL(10, 2) NOT NULL,
+        placed_at TIMESTAMP(6) NOT NULL,
+        INDEX idx_bids_post_id_id (post_id, id),
+        FOREIGN KEY (post_id) REFERENCES posts(id)
+    )
+    """,
+]
+# Lets the winner finalizer find ended auctions that still need a winner
+FINALIZER_POSTS_INDEXES = {
+    "idx_posts_winner_end_time": "CREATE INDEX idx_posts_winner_end_time ON posts (winner, end_time)",
+}
+# The denormalized like count search sorts on, with the statement that fills it in for
+# existing rows, and the indexes behind the search filters and sort orders
+SEARCH_POSTS_COLUMNS = {
+    "likes_count": (
+        "ALTER TABLE posts ADD COLUMN likes_count INT NOT NULL DEFAULT 0",
+        "UPDATE posts p SET likes_count = (SELECT COUNT(*) FROM post_likes pl WHERE pl.post_id = p.id)"
+    ),
+}
+SEARCH_POSTS_INDEXES = {
+    "idx_posts_end_time": "CREATE INDEX idx_posts_end_time ON posts (end_time)",
+    "idx_posts_username": "CREATE INDEX idx_posts_username ON posts (username)",
+    "idx_posts_current_bid": "CREATE INDEX idx_posts_current_bid ON posts (current_bid)",
+    "idx_posts_likes_count": "CREATE INDEX idx_posts_likes_count ON posts (likes_count)",
+    "ft_posts_title_description": "CREATE FULLTEXT INDEX ft_posts_title_description ON posts (title, description)",
+}
+SCHEMA_TABLES = [
+    *BID_HISTORY_TABLES,
+]
+# Columns added to posts, with the statement that fills them in for existing rows
+SCHEMA_POSTS_COLUMNS = {
+    **SEARCH_POSTS_COLUMNS,
+}
+SCHEMA_POSTS_INDEXES = {
+    **FINALIZER_POSTS_INDEXES,
+    **SEARCH_POSTS_INDEXES,
+}
+# Queries for the bulk export, each streamed in primary key order
+EXPORT_QUERIES = {
+    "posts": """
+        SELECT id, username, title, description, image, starting_price, current_bid, current_bidder, end_time, duration, winner, winning_bid, created_at
+        FROM posts ORDER BY id
+    """,
+    "bids": """
+        SELECT id, post_id, username, amount, placed_at
+        FROM bids ORDER BY id
+    """,
+    "winners": """
+        SELECT id AS post_id, title, username AS seller, winner, winning_bid, end_time
+        FROM posts WHERE winner IS NOT NULL ORDER BY id
+    """,
+}
+# Search sort orders: the posts column to order by and its direction
+SEARCH_SORTS = {
+    "ending_soon": ("end_time", "ASC"),
+    "price_low": ("current_bid", "ASC"),
+    "price_high": ("current_bid", "DESC"),
+    "likes": ("likes_count", "DESC"),
+}
 class DatabaseManager:
 
     def hash_token(self, token):
         return hashlib.sha256(token.encode()).hexdigest()
+
+    def ensure_schema(self, db):
+        cursor = db.cursor()
+        try:
+            for statement in SCHEMA_TABLES:
+                cursor.execute(statement)
+
+            cursor.execute(
+                "SELECT column_name FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = 'posts'"
+            )
+            existing = {row[0] for row in cursor.fetchall()}
+            for name, (statement, backfill) in SCHEMA_POSTS_COLUMNS.items():
+                if name in existing:
+                    continue
+                try:
+                    cursor.execute(statement)
+                except mysql.connector.Error as err:
+                    # Another worker starting at the same time added it first
+                    if err.errno != mysql.connector.errorcode.ER_DUP_FIELDNAME:
+                        raise
+                    continue
+                cursor.execute(backfill)
+
+            cursor.execute(
+                "SELECT DISTINCT index_name FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = 'posts'"
+            )
+            existing = {row[0] for row in cursor.fetchall()}
+            for name, statement in SCHEMA_POSTS_INDEXES.items():
+                if name in existing:
+                    continue
+                try:
+                    cursor.execute(statement)
+                except mysql.connector.Error as err:
+                    # Another worker starting at the same time created it first
+                    if err.errno != mysql.connector.errorcode.ER_DUP_KEYNAME:
+                        raise
+            db.commit()
+        finally:
+            cursor.close()
     
     def get_user_from_token(self, hashed_token, db):
         cursor = db.cursor()
@@ -97,6 +204,41 @@ class DatabaseManager:
         finally:
             cursor.close()
 
+    def insert_posts_bulk(self, posts, db):
+        cursor = db.cursor()
+        try:
+            # mysql-connector rewrites an INSERT ... VALUES executemany into a single multi-row INSERT
+            cursor.executemany(
+                "INSERT INTO posts(username, title, description, image, starting_price, current_bid, end_time, duration) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                posts
+            )
+            db.commit()
+        except mysql.connector.Error:
+            # Leave handling to the caller, which can retry the rows one by one
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def iter_export_rows(self, kind, db, batch_size=500):
+        # An unbuffered cursor streams the result set from the server as it is fetched,
+        # so only batch_size rows are held in memory at a time
+        cursor = db.cursor(dictionary=True, buffered=False)
+        exhausted = False
+        try:
+            cursor.execute(EXPORT_QUERIES[kind])
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    exhausted = True
+                    return
+                yield rows
+        finally:
+            # Reading the rest of an abandoned result set could take as long as the export
+            # itself, so it is left unread and the caller drops the connection instead
+            if exhausted:
+                cursor.close()
+
     def get_all_posts(self, token, db):
         cursor = db.cursor()
 
@@ -153,6 +295,64 @@ class DatabaseManager:
         finally:
             cursor.close()
 
+    def search_posts(self, token, text, status, min_price, max_price, seller, sort, after, limit, db):
+        sort_column, direction = SEARCH_SORTS[sort]
+        cursor = db.cursor()
+
+        try:
+            user_id = None
+            if token:
+                cursor.execute("SELECT id FROM users WHERE hashed_token = %s", (self.hash_token(token),))
+                user = cursor.fetchone()
+                user_id = user[0] if user else None
+
+            # Filter, seek and limit on posts alone, so each page only reads the rows it returns
+            # through the FULLTEXT, end_time, current_bid or likes_count index
+            filters = []
+            params = [user_id]
+            if text:
+                filters.append("MATCH(p.title, p.description) AGAINST (%s IN NATURAL LANGUAGE MODE)")
+                params.append(text)
+            if status == "active":
+                filters.append("p.end_time > NOW()")
+            elif status == "ended":
+                filters.append("p.end_time <= NOW()")
+            if min_price is not None:
+                filters.append("p.current_bid >= %s")
+                params.append(min_price)
+            if max_price is not None:
+                filters.append("p.current_bid <= %s")
+                params.append(max_price)
+            if seller:
+                filters.append("p.username = %s")
+                params.append(seller)
+
+            # Keyset pagination: continue strictly after the (sort value, id) of the last row returned
+            if after:
+                comparator = ">" if direction == "ASC" else "<"
+                filters.append(f"(p.{sort_column} {comparator} %s OR (p.{sort_column} = %s AND p.id {comparator} %s))")
+                params.extend([after[0], after[0], after[1]])
+            where_clause = "WHERE " + " AND ".join(filters) if filters else ""
+            params.append(limit)
+
+            query = f"""
+            SELECT 
+                p.id, p.username, p.title, p.description, p.image, p.starting_price, p.current_bid, p.current_bidder, p.end_time, p.duration, p.winner, p.winning_bid,
+                p.likes_count,
+                EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = %s) AS liked_by_user,
+                p.{sort_column} AS sort_value
+            FROM 
+                posts p
+            {where_clause}
+            ORDER BY p.{sort_column} {direction}, p.id {direction}
+            LIMIT %s
+            """
+            cursor.execute(query, tuple(params))
+            return cursor.fetchall()
+        except mysql.connector.Error as err:
+            raise HTTPException(status_code=500, detail=str(err))
+        finally:
+            cursor.close()
 
     def toggle_post_like(self, post_id, hashed_token, db):
         with db.cursor() as cursor:
@@ -168,13 +368,16 @@ class DatabaseManager:
             cursor.execute("SELECT id FROM post_likes WHERE post_id = %s AND user_id = %s", (post_id, user_id))
             result = cursor.fetchone()
 
+            # Keep the denormalized likes_count on posts in step, in the same transaction
             if result:
                 # User has liked the post, so remove the like
                 cursor.execute("DELETE FROM post_likes WHERE id = %s", (result[0],))
+                cursor.execute("UPDATE posts SET likes_count = likes_count - 1 WHERE id = %s", (post_id,))
                 likedByUser = False
             else:
                 # User hasn't liked the post, so add the like
                 cursor.execute("INSERT INTO post_likes (post_id, user_id) VALUES (%s, %s)", (post_id, user_id))
+                cursor.execute("UPDATE posts SET likes_count = likes_count + 1 WHERE id = %s", (post_id,))
                 likedByUser = True
 
             db.commit()
@@ -186,79 +389,129 @@ class DatabaseManager:
         return {"likes": likes[0] if likes else 0, "likedByUser": likedByUser}
 
 
-    def update_bid_if_higher(self, post_id, amount, token, db):
+    def update_bid_if_higher(self, post_id, amount, token, db, extension_window=0, extension_seconds=0):
         cursor = db.cursor()
         try:
             hashed_token = self.hash_token(token)
 
+            # Fetch username from token
+            cursor.execute("SELECT username FROM users WHERE hashed_token = %s", (hashed_token,))
+            user = cursor.fetchone()
+            if not user:
+                return "Invalid user."
+            username = user[0]
+
+            # Lock the auction row until commit, so the checks, the new bid and any
+            # extension of the deadline are applied atomically with respect to other
+            # bids and to the finalizer. The deadline is checked against the database
+            # clock, the same NOW() the finalizer uses, read with microseconds since it
+            # also timestamps the bid in the bid history.
+            cursor.execute(
+                "SELECT username, current_bid, end_time, winner, NOW(6) FROM posts WHERE id = %s FOR UPDATE",
+                (post_id,)
+            )
+            auction = cursor.fetchone()
+            if not auction:
+                return "Auction not found"
+            creator, current_bid, end_time, winner, current_time = auction
+
             # Check if the user is the creator of the post
-            cursor.execute("SELECT username FROM posts WHERE id = %s", (post_id,))
-            creator = cursor.fetchone()
-            if creator and creator[0] == self.get_username_from_token(token, db):
+            if creator == username:
                 return "Creator cannot bid on their own auction"
 
             # Check the current highest bid
             if amount > MAX_BID_AMOUNT:
                 return "The bid amount exceeds the maximum allowed value."
-            cursor.execute("SELECT current_bid, end_time FROM posts WHERE id = %s", (post_id,))
-            current_bid, end_time = cursor.fetchone()
-
-            eastern = pytz.timezone('US/Eastern')
-            current_time_in_eastern = datetime.datetime.now(eastern)
-            if end_time.tzinfo is None:
-                end_time = eastern.localize(end_time)
-            if current_time_in_eastern >= end_time:
+
+            if winner is not None or current_time >= end_time:
                 return "Auction has ended"
 
             if amount <= current_bid:
                 return "Bid amount must be greater than the current highest bid"
 
-            # Fetch user id from token
-            cursor.execute("SELECT username FROM users WHERE hashed_token = %s", (hashed_token,))
-            username = cursor.fetchone()[0]
+            # Anti-sniping: a bid in the final extension_window seconds pushes the deadline out
+            extended = extension_seconds > 0 and end_time - current_time <= datetime.timedelta(seconds=extension_window)
+            if extended:
+                end_time += datetime.timedelta(seconds=extension_seconds)
 
-            # Update current bid and bidder in posts table
-            cursor.execute("UPDATE posts SET current_bid = %s, current_bidder = %s WHERE id = %s", (amount, username, post_id))
+            # Update current bid, bidder and deadline in posts table
+            cursor.execute(
+                "UPDATE posts SET current_bid = %s, current_bidder = %s, end_time = %s WHERE id = %s",
+                (amount, username, end_time, post_id)
+            )
             
             db.commit()
-            return {"status": "success", "message": "Bid placed successfully", "bid_value": amount, "auction_id": post_id}
+            return {"status": "success", "message": "Bid placed successfully", "bid_value": amount, "auction_id": post_id, "bidder": username, "placed_at": current_time, "end_time": end_time, "extended": extended}
 
         except Exception as e:
             return str(e)
         finally:
+            # Release the row lock if the bid was rejected
+            if db.in_transaction:
+                db.rollback()
             cursor.close()
     
+    def get_bids_for_post(self, post_id, before_id, limit, db):
+        cursor = db.cursor(dictionary=True)
+        try:
+            # Keyset pagination on the (post_id, id) index, newest bids first
+            if before_id:
+                cursor.execute(
+                    "SELECT id, username, amount, placed_at FROM bids WHERE post_id = %s AND id < %s ORDER BY id DESC LIMIT %s",
+                    (post_id, before_id, limit)
+                )
+            else:
+                cursor.execute(
+                    "SELECT id, username, amount, placed_at FROM bids WHERE post_id = %s ORDER BY id DESC LIMIT %s",
+                    (post_id, limit)
+                )
+            return cursor.fetchall()
+        except mysql.connector.Error as err:
+            raise HTTPException(status_code=500, detail=str(err))
+        finally:
+            cursor.close()
+
+    def get_active_auction_deadlines(self, db):
+        cursor = db.cursor()
+        try:
+            # Also return the database clock, which is what bids are checked against
+            cursor.execute("SELECT NOW(3)")
+            (now,) = cursor.fetchone()
+            cursor.execute("SELECT id, end_time FROM posts WHERE end_time > %s", (now,))
+            return now, cursor.fetchall()
+        except mysql.connector.Error as err:
+            raise HTTPException(status_code=500, detail=str(err))
+        finally:
+            cursor.close()
+
     def get_ended_auctions_without_winners(self, db):
         cursor = db.cursor(dictionary=True)
-        query = """
-            SELECT * FROM posts 
-            WHERE end_time < NOW() 
-            AND winner IS NULL 
-            AND current_bid IS NOT NULL
-        """
-        cursor.execute(query)
-        return cursor.fetchall()
+        try:
+            query = """
+                SELECT id FROM posts 
+                WHERE end_time < NOW() 
+                AND winner IS NULL 
+                AND current_bidder IS NOT NULL
+            """
+            cursor.execute(query)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
     
     def update_auction_winner(self, auction_id, db):
         cursor = db.cursor()
-        
-        # Fetch the highest bidder and bid for the auction
-        query = """
-            SELECT current_bidder, current_bid
-            FROM posts 
-            WHERE id = %s
-        """
-        cursor.execute(query, (auction_id,))
-        result = cursor.fetchone()
-
-        current_bidder = result[0]
-        current_bid = result[1]
-
-        # Set the winner and winning bid for the auction
-        query = """
-            UPDATE posts 
-            SET winner = %s, winning_bid = %s 
-            WHERE id = %s
-        """
-        cursor.execute(query, (current_bidder, current_bid, auction_id))
-        db.commit()
\ No newline at end of file
+        try:
+            # Copy the highest bidder and bid into the winner columns in a single statement.
+            # The guards make this a no-op if the auction was already finalized or has been
+            # extended in the meantime, so running it more than once is harmless.
+            query = """
+                UPDATE posts 
+                SET winner = current_bidder, winning_bid = current_bid 
+                WHERE id = %s
+                AND winner IS NULL
+                AND end_time < NOW()
+            """
+            cursor.execute(query, (auction_id,))
+            db.commit()
+        finally:
+            cursor.close()
\ No newline at end of file
@@ -0,0 +1,74 @@
+import functools
+import os
+import socket
+import threading
+import time
+import uuid
+import redis
+
+# Extend the lease only if this node still owns it
+RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Delete the lease only if this node still owns it
+RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+class LeaderElector:
+    """
+    Elects a single leader among all workers and replicas using a lease stored in Redis.
+    Every process calls heartbeat() periodically: the leader renews its lease, everyone
+    else tries to take the lease over, which only succeeds once the leader has stopped
+    renewing it (for example because it died), so failover happens within one lease TTL.
+    """
+    def __init__(self, redis_client, lease_key, lease_ttl_ms=15000):
+        self.redis = redis_client
+        self.lease_key = lease_key
+        self.lease_ttl_ms = lease_ttl_ms
+        self.node_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_expires_at = 0.0
+        self.lock = threading.Lock()
+
+    def heartbeat(self):
+        # Measure the lease from before the round trip so our local view always expires
+        # no later than the key in Redis does
+        started = time.monotonic()
+        try:
+            acquired = bool(self.redis.eval(RENEW_LEASE_SCRIPT, 1, self.lease_key, self.node_id, self.lease_ttl_ms))
+            if not acquired:
+                acquired = bool(self.redis.set(self.lease_key, self.node_id, nx=True, px=self.lease_ttl_ms))
+        except redis.RedisError as e:
+            print(f"Error occurred: {e}")
+            acquired = False
+
+        with self.lock:
+            self.lease_expires_at = started + self.lease_ttl_ms / 1000 if acquired else 0.0
+        return acquired
+
+    def is_leader(self):
+        with self.lock:
+            return time.monotonic() < self.lease_expires_at
+
+    def release(self):
+        with self.lock:
+            self.lease_expires_at = 0.0
+        try:
+            self.redis.eval(RELEASE_LEASE_SCRIPT, 1, self.lease_key, self.node_id)
+        except redis.RedisError as e:
+            print(f"Error occurred: {e}")
+
+    def run_if_leader(self, job):
+        # Wrap a scheduled job so it is skipped on every process except the leader
+        @functools.wraps(job)
+        def wrapper(*args, **kwargs):
+            if self.is_leader():
+                return job(*args, **kwargs)
+        return wrapper
@@ -1,19 +1,233 @@
+import asyncio
+import collections
+import json
+import time
+import uuid
 import fastapi
 
+# Close codes sent to clients that disconnect, are evicted or are turned away
+CLOSE_NORMAL = 1000
+CLOSE_EVICTED = 4000
+CLOSE_TRY_AGAIN_LATER = 1013
+
 class WebSocketManager:
-    def __init__(self):
-        self.active_connections = []
+    """
+    Keeps track of the open WebSocket connections.
+    Connections are capped in total, per IP and per user. A background heartbeat pings
+    every client and evicts the ones that have not sent anything (including a pong)
+    within idle_timeout seconds, and sends that time out are treated as dead clients.
+
+    Every message to a client goes through that client's own ordered outbound queue,
+    drained by a sender task, so a slow client only ever holds up itself. Clients that
+    fall more than max_queued_messages behind are evicted.
+
+    Broadcast events carry a sequence number and the last history_size of them are kept,
+    so a reconnecting client can resume from the last sequence it saw. Only the latest
+    newPost event is kept, since each one carries the whole feed. Sequence numbers are
+    only meaningful within one epoch, which identifies this process.
+    """
+    def __init__(self, max_connections=1000, max_connections_per_ip=20, max_connections_per_user=5,
+                 heartbeat_interval=20, idle_timeout=60, send_timeout=5, history_size=1000,
+                 max_queued_messages=100):
+        self.max_connections = max_connections
+        self.max_connections_per_ip = max_connections_per_ip
+        self.max_connections_per_user = max_connections_per_user
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.send_timeout = send_timeout
+        self.max_queued_messages = max_queued_messages
+        # Maps each open websocket to its client IP, username, activity timestamps,
+        # outbound queue and sender task
+        self.active_connections = {}
+        self.heartbeat_task = None
+        self.rejected_total = 0
+        self.evicted_total = 0
+        self.epoch = uuid.uuid4().hex
+        self.sequence = 0
+        # Ring buffer of (sequence, event type, serialized event) for recent broadcasts, and
+        # the last sequence that has fallen out of it
+        self.history = collections.deque(maxlen=history_size)
+        self.history_floor = 0
+
+    def start(self):
+        if self.heartbeat_task is None:
+            self.heartbeat_task = asyncio.create_task(self.run_heartbeat())
+
+    async def stop(self):
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+            try:
+                await self.heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self.heartbeat_task = None
 
-    async def connect(self, websocket: fastapi.WebSocket):
+    def check_limits(self, client_ip, username):
+        if len(self.active_connections) >= self.max_connections:
+            return "Server is at its connection limit"
+        infos = self.active_connections.values()
+        if sum(1 for info in infos if info["client_ip"] == client_ip) >= self.max_connections_per_ip:
+            return "Too many connections from this address"
+        if username and sum(1 for info in infos if info["username"] == username) >= self.max_connections_per_user:
+            return "Too many connections for this user"
+        return None
+
+    async def connect(self, websocket: fastapi.WebSocket, client_ip: str, username: str = None,
+                      epoch: str = None, last_seq: int = None):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        reason = self.check_limits(client_ip, username)
+        if reason:
+            self.rejected_total += 1
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason=reason)
+            return False
+
+        # Queue the hello and, for a reconnect, the missed events before the socket joins
+        # the broadcast set. There is no await in between, so no live event can be queued
+        # ahead of the replay.
+        queue = asyncio.Queue()
+        queue.put_nowait(json.dumps({"type": "hello", "epoch": self.epoch, "seq": self.sequence}))
+        if epoch is not None and last_seq is not None:
+            for data in self.missed_events(epoch, last_seq):
+                queue.put_nowait(data)
+
+        now = time.monotonic()
+        self.active_connections[websocket] = {
+            "client_ip": client_ip,
+            "username": username,
+            "connected_at": now,
+            "last_seen": now,
+            "queue": queue,
+            "sender": asyncio.create_task(self.run_sender(websocket, queue)),
+        }
+        return True
+
+    def missed_events(self, epoch: str, last_seq: int):
+        # The client must do a full reload if it was talking to another process, or if
+        # some of the events it missed have already fallen out of the ring buffer. Older
+        # newPost events dropped from the buffer do not count, a later newPost supersedes them.
+        if epoch != self.epoch or last_seq > self.sequence or last_seq < self.history_floor:
+            return [json.dumps({"type": "resync", "epoch": self.epoch, "seq": self.sequence})]
 
-    def disconnect(self, websocket: fastapi.WebSocket):
-        self.active_connections.remove(websocket)
+        missed = [(seq, event_type, data) for seq, event_type, data in self.history if seq > last_seq]
+        # A newPost event carries the whole feed, so anything before the last one is superseded
+        for index in range(len(missed) - 1, -1, -1):
+            if missed[index][1] == "newPost":
+                missed = missed[index:]
+                break
+        # Replaying more than a client may have queued would only get it evicted as too slow
+        if len(missed) >= self.max_queued_messages:
+            return [json.dumps({"type": "resync", "epoch": self.epoch, "seq": self.sequence})]
+        return [data for _, _, data in missed]
+
+    async def disconnect(self, websocket: fastapi.WebSocket):
+        info = self.active_connections.pop(websocket, None)
+        if not info:
+            return
+        # Let the sender deliver what is already queued, such as an error reply, and close
+        # the socket, giving up on a client that does not take it within send_timeout
+        info["queue"].put_nowait((CLOSE_NORMAL, ""))
+        done, _ = await asyncio.wait({info["sender"]}, timeout=self.send_timeout)
+        if not done:
+            info["sender"].cancel()
+
+    def touch(self, websocket: fastapi.WebSocket):
+        info = self.active_connections.get(websocket)
+        if info:
+            info["last_seen"] = time.monotonic()
+
+    def evict(self, websocket: fastapi.WebSocket, reason: str):
+        info = self.active_connections.pop(websocket, None)
+        if not info:
+            return
+        self.evicted_total += 1
+        # Drop whatever is still queued and have the sender task close the socket
+        queue = info["queue"]
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait((CLOSE_EVICTED, reason))
+
+    async def run_sender(self, websocket: fastapi.WebSocket, queue: asyncio.Queue):
+        while True:
+            data = await queue.get()
+            if isinstance(data, tuple):
+                code, reason = data
+                try:
+                    await asyncio.wait_for(websocket.close(code=code, reason=reason), self.send_timeout)
+                except Exception:
+                    # The socket is already gone, nothing left to clean up
+                    pass
+                return
+            try:
+                await asyncio.wait_for(websocket.send_text(data), self.send_timeout)
+            except Exception:
+                if websocket not in self.active_connections:
+                    # Already disconnected, nothing else queued can be delivered either
+                    return
+                self.evict(websocket, "Send failed")
 
     async def send_personal_message(self, message: str, websocket: fastapi.WebSocket):
-        await websocket.send_text(message)
+        await self.send(websocket, message)
+
+    async def send(self, websocket: fastapi.WebSocket, data: str):
+        self.enqueue(websocket, data)
+
+    def enqueue(self, websocket: fastapi.WebSocket, data: str):
+        info = self.active_connections.get(websocket)
+        if not info:
+            return
+        if info["queue"].qsize() >= self.max_queued_messages:
+            self.evict(websocket, "Too far behind")
+            return
+        info["queue"].put_nowait(data)
 
     async def broadcast(self, data: str):
-        for connection in self.active_connections:
-            await connection.send_text(data)
+        for connection in list(self.active_connections):
+            self.enqueue(connection, data)
+
+    async def broadcast_event(self, event: dict, default=None):
+        # Assigning the sequence number, recording the event and queueing it for every
+        # client happens without yielding to the event loop, so all clients see events in
+        # sequence order without any lock being held while the sends are in flight
+        self.sequence += 1
+        data = json.dumps(dict(event, seq=self.sequence, epoch=self.epoch), default=default)
+        if event["type"] == "newPost":
+            # A replay never goes further back than the last newPost, so keep only the
+            # latest copy of the feed instead of up to history_size of them
+            self.history = collections.deque(
+                (entry for entry in self.history if entry[1] != "newPost"), maxlen=self.history.maxlen
+            )
+        if len(self.history) == self.history.maxlen:
+            self.history_floor = self.history[0][0]
+        self.history.append((self.sequence, event["type"], data))
+        for connection in list(self.active_connections):
+            self.enqueue(connection, data)
+
+    async def run_heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            ping = json.dumps({"type": "ping"})
+            for websocket, info in list(self.active_connections.items()):
+                if now - info["last_seen"] > self.idle_timeout:
+                    self.evict(websocket, "Idle timeout")
+                else:
+                    self.enqueue(websocket, ping)
+
+    def stats(self):
+        now = time.monotonic()
+        infos = list(self.active_connections.values())
+        return {
+            "connections": len(infos),
+            "unique_ips": len({info["client_ip"] for info in infos}),
+            "authenticated_users": len({info["username"] for info in infos if info["username"]}),
+            "oldest_connection_seconds": round(max((now - info["connected_at"] for info in infos), default=0), 1),
+            "queued_messages": sum(info["queue"].qsize() for info in infos),
+            "max_connections": self.max_connections,
+            "max_connections_per_ip": self.max_connections_per_ip,
+            "max_connections_per_user": self.max_connections_per_user,
+            "rejected_total": self.rejected_total,
+            "evicted_total": self.evicted_total,
+            "epoch": self.epoch,
+            "sequence": self.sequence,
+            "history_size": len(self.history),
+        }